@@ -13,21 +13,36 @@ Usage:
   python visual_debug.py --batch rollouts/rollout_0042/
 
 Requires: pip install Pillow
+  (or pillow-simd, a drop-in build with SIMD line/composite routines:
+   pip uninstall Pillow && pip install pillow-simd — falls back to stock
+   Pillow transparently, since both install as the `PIL` package)
+Optional: pip install orjson (faster dom/diag parsing; stdlib json otherwise)
 """
 
 import argparse
+import functools
 import json
 import math
-import re
+import os
+import queue
+import shutil
 import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 try:
     from PIL import Image, ImageDraw, ImageFont
 except ImportError:
-    print("Error: Pillow is required. Install with: pip install Pillow", file=sys.stderr)
+    print("Error: Pillow is required. Install with: pip install Pillow "
+          "(or pip install pillow-simd for faster drawing)", file=sys.stderr)
     sys.exit(1)
 
+try:
+    import orjson  # optional: faster parsing of large dom/diag files
+except ImportError:
+    orjson = None
+
 # ── Colors (RGBA) ──
 
 BBOX_COLOR = (34, 197, 94, 255)          # green  #22c55e
@@ -36,56 +51,77 @@ CONTENTBOX_COLOR = (236, 72, 153, 255)   # pink   #ec4899
 OVERFLOW_COLOR = (239, 68, 68, 255)      # red    #ef4444
 OVERLAP_COLOR = (234, 179, 8, 180)       # yellow #eab308 semi-transparent
 OOB_COLOR = (239, 68, 68, 255)           # red    #ef4444
+OVERFLOW_TINT = (239, 68, 68, 30)        # red    #ef4444 faint fill
 SUMMARY_BG = (0, 0, 0, 190)             # dark semi-transparent
 SUMMARY_FG = (255, 255, 255, 255)
 
+# Debug images are throwaway artifacts: favor encode speed over file size
+PNG_COMPRESS_LEVEL = 1
 
-# ── Drawing helpers ──
-
-def draw_dashed_line(draw, start, end, fill, width=1, dash=(6, 4)):
-    """Draw a dashed line segment."""
-    x1, y1 = start
-    x2, y2 = end
-    dx, dy = x2 - x1, y2 - y1
-    length = math.hypot(dx, dy)
-    if length < 1:
-        return
-    ux, uy = dx / length, dy / length
-    on_len, off_len = dash
-    pos = 0.0
-    drawing = True
-    while pos < length:
-        seg = on_len if drawing else off_len
-        end_pos = min(pos + seg, length)
-        if drawing:
-            sx = x1 + ux * pos
-            sy = y1 + uy * pos
-            ex = x1 + ux * end_pos
-            ey = y1 + uy * end_pos
-            draw.line([(sx, sy), (ex, ey)], fill=fill, width=width)
-        pos = end_pos
-        drawing = not drawing
 
+# ── Drawing helpers ──
 
 def draw_solid_rect(draw, x, y, w, h, outline, width=1):
     """Draw a solid-outline rectangle."""
     draw.rectangle([x, y, x + w, y + h], outline=outline, width=width)
 
 
-def draw_dashed_rect(draw, x, y, w, h, fill, width=1, dash=(6, 4)):
-    """Draw a dashed-outline rectangle."""
-    corners = [(x, y), (x + w, y), (x + w, y + h), (x, y + h)]
-    for i in range(4):
-        draw_dashed_line(draw, corners[i], corners[(i + 1) % 4], fill, width, dash)
-
-
-def draw_filled_rect(draw, x, y, w, h, fill):
-    """Draw a filled rectangle (no outline)."""
-    draw.rectangle([x, y, x + w, y + h], fill=fill)
+def dash_pattern(length, dash=(6, 4)):
+    """Build the "L" pixel bytes of a dashed run covering pixels 0..length."""
+    on_len, off_len = dash
+    stride = on_len + off_len
+    lit = min(on_len + 1, stride)
+    period = b"\xff" * lit + b"\x00" * (stride - lit)
+    return (period * (length // stride + 1))[:length + 1]
+
+
+@functools.lru_cache(maxsize=256)
+def dashed_rect_strips(w, h, width=1, dash=(6, 4)):
+    """Rasterize the (top, right, bottom, left) dash masks of a w×h rect."""
+    strips = []
+    for length, vertical, reverse in ((w, False, False), (h, True, False),
+                                      (w, False, True), (h, True, True)):
+        if length < 1:
+            strips.append(None)
+            continue
+        run = dash_pattern(length, dash)
+        if reverse:
+            run = run[::-1]
+        strip = Image.frombytes("L", (length + 1, width), run * width)
+        if vertical:
+            strip = strip.transpose(Image.Transpose.TRANSPOSE)
+        strips.append(strip)
+    return tuple(strips)
+
+
+def draw_dashed_rect(img, x, y, w, h, fill, width=1, dash=(6, 4)):
+    """Draw a dashed-outline rectangle by stamping cached dash masks."""
+    # Snap corners, not sizes, so the far edge lands where Pillow puts it
+    x0, y0 = math.floor(x), math.floor(y)
+    x, y, w, h = x0, y0, math.floor(x + w) - x0, math.floor(y + h) - y0
+    c = width // 2
+    offsets = [(x, y - c), (x + w - c, y), (x, y + h - c), (x - c, y)]
+    for strip, pos in zip(dashed_rect_strips(w, h, width, dash), offsets):
+        if strip is not None:
+            img.paste(fill, pos, strip)
+
+
+def draw_filled_rect(img, x, y, w, h, fill):
+    """Blend a filled rectangle (no outline) onto img in place."""
+    if img.mode != "RGBA":
+        ImageDraw.Draw(img, "RGBA").rectangle([x, y, x + w, y + h], fill=fill)
+        return
+    x0, y0 = max(round(x), 0), max(round(y), 0)
+    x1 = min(round(x + w) + 1, img.width)
+    y1 = min(round(y + h) + 1, img.height)
+    if x1 <= x0 or y1 <= y0:
+        return
+    img.alpha_composite(Image.new("RGBA", (x1 - x0, y1 - y0), fill), (x0, y0))
 
 
+@functools.lru_cache(maxsize=8)
 def get_font(size=11):
-    """Try to load a monospace font, fall back to default."""
+    """Try to load a monospace font, fall back to default (cached per size)."""
     for name in ["consola.ttf", "Consolas.ttf", "DejaVuSansMono.ttf",
                   "LiberationMono-Regular.ttf", "courier.ttf"]:
         try:
@@ -99,22 +135,42 @@ def get_font(size=11):
         return ImageFont.load_default()
 
 
+def rect_tuple(r):
+    """Unpack an {x,y,w,h} dict into an (x, y, w, h) tuple."""
+    return r["x"], r["y"], r["w"], r["h"]
+
+
 def intersect_rects(a, b):
-    """Compute intersection of two {x,y,w,h} dicts, or None."""
-    x = max(a["x"], b["x"])
-    y = max(a["y"], b["y"])
-    right = min(a["x"] + a["w"], b["x"] + b["w"])
-    bottom = min(a["y"] + a["h"], b["y"] + b["h"])
-    w = right - x
-    h = bottom - y
+    """Compute intersection of two (x, y, w, h) tuples, or None."""
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    x = max(ax, bx)
+    y = max(ay, by)
+    w = min(ax + aw, bx + bw) - x
+    h = min(ay + ah, by + bh) - y
     if w <= 0 or h <= 0:
         return None
-    return {"x": x, "y": y, "w": w, "h": h}
+    return x, y, w, h
+
+
+def load_json(path):
+    """Parse a JSON file, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(Path(path).read_bytes())
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_png(img, path):
+    """Encode a debug image with the fast PNG settings."""
+    img.save(str(path), format="PNG",
+             compress_level=PNG_COMPRESS_LEVEL, optimize=False)
 
 
 # ── Core rendering ──
 
-def render_debug(dom, render_path, diag=None, layers=None, output_path=None):
+def render_debug(dom, render_path, diag=None, layers=None, output_path=None,
+                 font=None, font_small=None, save=save_png):
     """
     Overlay bounding boxes on a rendered slide screenshot.
 
@@ -124,70 +180,107 @@ def render_debug(dom, render_path, diag=None, layers=None, output_path=None):
         diag: optional parsed diag JSON
         layers: list of layer names to draw (default: all three)
         output_path: output path (default: debug_N.png next to render)
+        font: summary font (default: get_font(11))
+        font_small: EID label font (default: get_font(9))
+        save: callable(img, path) that writes the result (default: save_png)
     """
     if layers is None:
         layers = ["bbox", "safeBox", "contentBox"]
 
-    base = Image.open(render_path).convert("RGBA")
-    overlay = Image.new("RGBA", base.size, (0, 0, 0, 0))
-    draw = ImageDraw.Draw(overlay)
-    font = get_font(11)
-    font_small = get_font(9)
+    if output_path is None:
+        # Derive from render path: render_0.png → debug_0.png
+        rp = Path(render_path)
+        output_path = rp.parent / rp.name.replace("render_", "debug_")
 
-    # ── Draw box layers per element ──
-    for el in dom["elements"]:
-        eid = el["eid"]
-        bbox = el["bbox"]
-        safe = el["safeBox"]
-        content = el.get("contentBox")
-
-        has_overflow = False
-        if diag:
-            has_overflow = any(
-                d["type"] == "content_overflow"
-                and (d.get("eid") == eid or d.get("owner_eid") == eid)
-                for d in diag.get("defects", [])
-            )
-
-        # bbox — green solid
-        if "bbox" in layers:
+    # Nothing to draw: copy the render as-is instead of decoding,
+    # allocating and re-encoding a full-size image
+    elements = dom["elements"]
+    if not diag and not (layers and elements):
+        try:
+            shutil.copyfile(render_path, output_path)
+        except shutil.SameFileError:
+            pass
+        return output_path
+
+    # Large read buffer helps on network filesystems. RGB (Playwright's
+    # default) and RGBA renders are drawn on as-is; other modes are converted,
+    # keeping an alpha channel when the source has one.
+    with open(render_path, "rb", buffering=1 << 20) as f:
+        base = Image.open(f)
+        base.load()
+    if base.mode not in ("RGB", "RGBA"):
+        has_alpha = base.mode in ("LA", "PA") or "transparency" in base.info
+        base = base.convert("RGBA" if has_alpha else "RGB")
+    # Strokes go straight onto the screenshot; there is no full-size overlay
+    draw = ImageDraw.Draw(base, "RGBA")
+    if font is None:
+        font = get_font(11)
+    if font_small is None:
+        font_small = get_font(9)
+
+    # ── Draw box layers, one pass per layer ──
+    # Layer checks and colors are resolved once per layer rather than once
+    # per element, and each pass issues a single kind of draw call.
+    defects = diag.get("defects", []) if diag else []
+    # Built once so each contentBox check is a set probe, not a defect scan
+    overflow_eids = {eid for d in defects if d["type"] == "content_overflow"
+                     for eid in (d.get("eid"), d.get("owner_eid"))}
+
+    # bbox — green solid
+    if "bbox" in layers:
+        for el in elements:
+            bbox = el["bbox"]
             draw_solid_rect(draw, bbox["x"], bbox["y"], bbox["w"], bbox["h"],
                             outline=BBOX_COLOR, width=1)
 
-        # safeBox — orange dashed
-        if "safeBox" in layers:
-            draw_dashed_rect(draw, safe["x"], safe["y"], safe["w"], safe["h"],
+    # safeBox — orange dashed
+    if "safeBox" in layers:
+        for el in elements:
+            safe = el["safeBox"]
+            draw_dashed_rect(base, safe["x"], safe["y"], safe["w"], safe["h"],
                              fill=SAFEBOX_COLOR, width=1, dash=(6, 3))
 
-        # contentBox — pink dotted (red if overflow)
-        if "contentBox" in layers and content:
-            color = OVERFLOW_COLOR if has_overflow else CONTENTBOX_COLOR
-            width = 2 if has_overflow else 1
-            draw_dashed_rect(draw, content["x"], content["y"],
-                             content["w"], content["h"],
-                             fill=color, width=width, dash=(3, 2))
-
-        # EID label
-        if "bbox" in layers:
-            draw.text((bbox["x"] + 2, bbox["y"] - 12), eid,
+    # contentBox — pink dotted (red if overflow)
+    # Boxes are grouped by stroke style up front; overflowing ones go last so
+    # their red strokes are never covered by a neighbour's pink one.
+    if "contentBox" in layers:
+        normal, overflowing = [], []
+        for el in elements:
+            content = el.get("contentBox")
+            if content:
+                group = overflowing if el["eid"] in overflow_eids else normal
+                group.append(rect_tuple(content))
+
+        for rects, color, width in ((normal, CONTENTBOX_COLOR, 1),
+                                    (overflowing, OVERFLOW_COLOR, 2)):
+            for rect in rects:
+                draw_dashed_rect(base, *rect, fill=color, width=width,
+                                 dash=(3, 2))
+
+    # EID labels — last, so no box stroke is drawn over them
+    if "bbox" in layers:
+        for el in elements:
+            bbox = el["bbox"]
+            draw.text((bbox["x"] + 2, bbox["y"] - 12), el["eid"],
                       fill=BBOX_COLOR, font=font_small)
 
     # ── Defect annotations (when diag provided) ──
     if diag:
-        elements_by_eid = {el["eid"]: el for el in dom["elements"]}
+        elements_by_eid = {el["eid"]: el for el in elements}
+        # Unpacked once so overlap intersections are plain tuple arithmetic
+        safe_rects = {el["eid"]: rect_tuple(el["safeBox"]) for el in elements}
 
-        for defect in diag.get("defects", []):
+        for defect in defects:
             dtype = defect["type"]
 
             # Overlap zones — yellow fill
             if dtype == "overlap":
-                owner = elements_by_eid.get(defect.get("owner_eid"))
-                other = elements_by_eid.get(defect.get("other_eid"))
+                owner = safe_rects.get(defect.get("owner_eid"))
+                other = safe_rects.get(defect.get("other_eid"))
                 if owner and other:
-                    inter = intersect_rects(owner["safeBox"], other["safeBox"])
+                    inter = intersect_rects(owner, other)
                     if inter:
-                        draw_filled_rect(draw, inter["x"], inter["y"],
-                                         inter["w"], inter["h"], fill=OVERLAP_COLOR)
+                        draw_filled_rect(base, *inter, fill=OVERLAP_COLOR)
 
             # Content overflow — red tint
             if dtype == "content_overflow":
@@ -195,21 +288,21 @@ def render_debug(dom, render_path, diag=None, layers=None, output_path=None):
                 el = elements_by_eid.get(eid)
                 if el:
                     b = el["bbox"]
-                    draw_filled_rect(draw, b["x"], b["y"], b["w"], b["h"],
-                                     fill=(239, 68, 68, 30))
+                    draw_filled_rect(base, b["x"], b["y"], b["w"], b["h"],
+                                     fill=OVERFLOW_TINT)
 
-            # OOB — red edge line
+            # OOB — red 3px edge strip (axis-aligned fill, not a wide line)
             if dtype == "out_of_bounds":
                 edge = defect["details"]["edge"]
                 sw, sh = dom["slide"]["w"], dom["slide"]["h"]
                 if edge == "left":
-                    draw.line([(0, 0), (0, sh)], fill=OOB_COLOR, width=3)
+                    draw.rectangle([0, 0, 2, sh - 1], fill=OOB_COLOR)
                 elif edge == "right":
-                    draw.line([(sw - 1, 0), (sw - 1, sh)], fill=OOB_COLOR, width=3)
+                    draw.rectangle([sw - 3, 0, sw - 1, sh - 1], fill=OOB_COLOR)
                 elif edge == "top":
-                    draw.line([(0, 0), (sw, 0)], fill=OOB_COLOR, width=3)
+                    draw.rectangle([0, 0, sw - 1, 2], fill=OOB_COLOR)
                 elif edge == "bottom":
-                    draw.line([(0, sh - 1), (sw, sh - 1)], fill=OOB_COLOR, width=3)
+                    draw.rectangle([0, sh - 3, sw - 1, sh - 1], fill=OOB_COLOR)
 
         # ── Summary box (top-left) ──
         summary = diag.get("summary", {})
@@ -225,28 +318,83 @@ def render_debug(dom, render_path, diag=None, layers=None, output_path=None):
 
         line_h = 16
         pad = 8
-        box_w = max(len(l) for l in lines) * 7 + pad * 2
+        box_w = int(max(draw.textlength(l, font=font) for l in lines)) + pad * 2
         box_h = len(lines) * line_h + pad * 2
-        draw_filled_rect(draw, 4, 4, box_w, box_h, fill=SUMMARY_BG)
+        draw_filled_rect(base, 4, 4, box_w, box_h, fill=SUMMARY_BG)
         for i, line in enumerate(lines):
             draw.text((4 + pad, 4 + pad + i * line_h), line,
                       fill=SUMMARY_FG, font=font)
 
-    # ── Composite and save ──
-    result = Image.alpha_composite(base, overlay)
-
-    if output_path is None:
-        # Derive from render path: render_0.png → debug_0.png
-        rp = Path(render_path)
-        output_path = rp.parent / rp.name.replace("render_", "debug_")
-
-    result.save(str(output_path))
-    print(f"  wrote {output_path}")
+    # ── Save ──
+    save(base, output_path)
     return output_path
 
 
-def run_batch(rollout_dir, layers=None):
-    """Process an entire rollout directory."""
+def _render_iteration(dom_path, render_path, diag_path, output_path, layers,
+                      font=None, font_small=None, save=save_png):
+    """Batch worker: load one iteration's JSON and render its debug image."""
+    dom = load_json(dom_path)
+    diag = load_json(diag_path) if diag_path.exists() else None
+
+    render_debug(dom, str(render_path), diag=diag, layers=layers,
+                 output_path=output_path, font=font, font_small=font_small,
+                 save=save)
+    return diag is not None
+
+
+def _report_iteration(n, has_diag, output_path):
+    """Print the batch progress line for one written iteration."""
+    print(f"  iter {n}:{' +diag' if has_diag else ''}  wrote {output_path}")
+
+
+def _run_serial(tasks, layers):
+    """Render iterations in-process, encoding PNGs on a writer thread."""
+    pending = queue.Queue(maxsize=2)
+    failed = []
+
+    def writer():
+        while True:
+            item = pending.get()
+            if item is None:
+                break
+            if failed:
+                continue  # keep draining so the renderer never blocks on put
+            n, has_diag, img, output_path = item
+            try:
+                # img is None when render_debug already copied the render
+                if img is not None:
+                    save_png(img, output_path)
+            except Exception as e:
+                failed.append(e)
+                continue
+            _report_iteration(n, has_diag, output_path)
+
+    # Everything runs in this process, so the fonts are loaded once up front
+    font = get_font(11)
+    font_small = get_font(9)
+
+    thread = threading.Thread(target=writer, daemon=True)
+    thread.start()
+    try:
+        for n, dom_path, render_path, diag_path, output_path in tasks:
+            if failed:
+                break
+            rendered = []
+            has_diag = _render_iteration(
+                dom_path, render_path, diag_path, output_path, layers,
+                font=font, font_small=font_small,
+                save=lambda img, path: rendered.append(img))
+            pending.put((n, has_diag, rendered[0] if rendered else None,
+                         output_path))
+    finally:
+        pending.put(None)
+        thread.join()
+    if failed:
+        raise failed[0]
+
+
+def run_batch(rollout_dir, layers=None, jobs=None):
+    """Process an entire rollout directory with up to `jobs` workers."""
     rollout = Path(rollout_dir)
     if not rollout.is_dir():
         print(f"Error: {rollout} is not a directory", file=sys.stderr)
@@ -260,12 +408,12 @@ def run_batch(rollout_dir, layers=None):
 
     print(f"Batch processing {rollout} ({len(dom_files)} iterations)")
 
+    tasks = []
     for dom_path in dom_files:
-        # Extract iteration number: dom_0.json → 0
-        match = re.search(r"dom_(\d+)\.json$", dom_path.name)
-        if not match:
+        # Extract iteration number: dom_0.json → 0 (glob guarantees "dom_")
+        n = dom_path.stem[len("dom_"):]
+        if not n.isdigit():
             continue
-        n = match.group(1)
 
         render_path = rollout / f"render_{n}.png"
         diag_path = rollout / f"diag_{n}.json"
@@ -275,18 +423,45 @@ def run_batch(rollout_dir, layers=None):
             print(f"  skip iter {n}: {render_path.name} not found")
             continue
 
-        print(f"  iter {n}:", end="")
-        with open(dom_path) as f:
-            dom = json.load(f)
+        tasks.append((n, dom_path, render_path, diag_path, output_path))
+
+    if not tasks:
+        return
+
+    # Never start more workers than there are iterations to render; a single
+    # worker gains nothing from a process pool
+    workers = min(jobs or os.cpu_count() or 1, len(tasks))
+    if workers == 1:
+        _run_serial(tasks, layers)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            (n, output_path,
+             pool.submit(_render_iteration, dom_path, render_path, diag_path,
+                         output_path, layers))
+            for n, dom_path, render_path, diag_path, output_path in tasks
+        ]
+        # Report in iteration order; result() re-raises worker errors
+        try:
+            for n, output_path, future in futures:
+                has_diag = future.result()
+                _report_iteration(n, has_diag, output_path)
+        except BaseException:
+            # Stop at the first failure, like the serial path: drop queued work
+            pool.shutdown(cancel_futures=True)
+            raise
 
-        diag = None
-        if diag_path.exists():
-            with open(diag_path) as f:
-                diag = json.load(f)
-            print(f" +diag", end="")
 
-        render_debug(dom, str(render_path), diag=diag, layers=layers,
-                     output_path=output_path)
+def positive_int(value):
+    """argparse type for counts that must be at least 1."""
+    try:
+        n = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid int value: {value!r}")
+    if n < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {n}")
+    return n
 
 
 def main():
@@ -310,26 +485,25 @@ def main():
                         help="Which layers to draw (default: all)")
     parser.add_argument("--batch", metavar="DIR",
                         help="Process entire rollout directory")
+    parser.add_argument("-j", "--jobs", type=positive_int,
+                        help="Worker processes for --batch (default: CPU count; "
+                             "1 renders in-process with a background PNG writer)")
 
     args = parser.parse_args()
 
     if args.batch:
-        run_batch(args.batch, layers=args.layers)
+        run_batch(args.batch, layers=args.layers, jobs=args.jobs)
         return
 
     if not args.dom_json or not args.render_png:
         parser.error("dom_json and render_png are required (or use --batch)")
 
-    with open(args.dom_json) as f:
-        dom = json.load(f)
-
-    diag = None
-    if args.diag:
-        with open(args.diag) as f:
-            diag = json.load(f)
+    dom = load_json(args.dom_json)
+    diag = load_json(args.diag) if args.diag else None
 
-    render_debug(dom, args.render_png, diag=diag, layers=args.layers,
-                 output_path=args.output)
+    output_path = render_debug(dom, args.render_png, diag=diag,
+                               layers=args.layers, output_path=args.output)
+    print(f"  wrote {output_path}")
 
 
 if __name__ == "__main__":